@@ -1,110 +1,415 @@
 import streamlit as st
 import polars as pl
-import yfinance as yf
+import numpy as np
 import requests
-from datetime import datetime, timedelta
-import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import os
+import time
+import glob
+import hashlib
+import threading
+import tempfile
+import contextlib
+
+try:
+    import aiohttp
+except ImportError:  # fall back to requests on a thread pool
+    aiohttp = None
+
 st.set_page_config(page_title="Dark Pool Screener", layout="wide")
 
 # === PREVENT ABUSE & STAY UNDER FREE LIMITS ===
 st.cache_data(ttl=86400)        # cache everything for 24h
 st.cache_resource(ttl=86400)    # same for resources
 # =============================================
-# 1. Download single FINRA day
+# 1. Download FINRA days (concurrently)
 # =============================================
-@st.cache_data(ttl=3600, show_spinner=False)
-def download_finra_date(date_str: str):
-    url = f"https://cdn.finra.org/equity/regsho/daily/CNMSshvol{date_str}.txt"
+CACHE_DIR = "cache"
+
+
+def write_parquet_atomic(df: pl.DataFrame, path: str, **kwargs):
+    # Unique temp file per writer, then an atomic rename – concurrent sessions writing the
+    # same path never move each other's half-written file into place
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".parquet.tmp")
+    os.close(fd)
     try:
-        resp = requests.get(url, timeout=15)
-        if resp.status_code != 200:
-            return None
+        df.write_parquet(tmp_path, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+# CNMSshvol layout is fixed, so skip dtype inference entirely. Volumes are read as
+# floats – fractional values must not fail the whole day – and BuyVolume is cast back.
+FINRA_SCHEMA = {
+    "Date": pl.Utf8,
+    "Symbol": pl.Utf8,
+    "ShortVolume": pl.Float64,
+    "ShortExemptVolume": pl.Float64,
+    "TotalVolume": pl.Float64,
+    "Market": pl.Utf8,
+}
+
+# Raw downloads memoized per process for days the parquet cache could not store –
+# module globals outlive Streamlit reruns and cache_data invalidation, so such a day
+# is still fetched only once. Shared by the thread pool and concurrent sessions.
+FINRA_BYTES = {}
+FINRA_BYTES_MAX = 256
+FINRA_BYTES_LOCK = threading.Lock()
+
+
+def remember_finra_bytes(date_str: str, body: bytes):
+    with FINRA_BYTES_LOCK:
+        if len(FINRA_BYTES) >= FINRA_BYTES_MAX:
+            FINRA_BYTES.pop(next(iter(FINRA_BYTES)), None)  # evict the oldest download
+        FINRA_BYTES[date_str] = body
+
+
+def recall_finra_bytes(date_str: str):
+    with FINRA_BYTES_LOCK:
+        return FINRA_BYTES.get(date_str)
+
+
+def finra_url(date_str: str):
+    return f"https://cdn.finra.org/equity/regsho/daily/CNMSshvol{date_str}.txt"
+
+
+def finra_cache_path(date_str: str):
+    return os.path.join(CACHE_DIR, f"CNMSshvol{date_str}.parquet")
+
+
+def parse_finra_date(body: bytes, date_str: str):
+    try:
+        # body is already one contiguous buffer – hand it straight to the reader.
+        # Date is replaced below and Market is never used, so neither is materialized.
         df = pl.read_csv(
-            io.BytesIO(resp.content),
+            body,
             separator="|",
             has_header=True,
-        ).with_columns(pl.lit(datetime.strptime(date_str, "%Y%m%d").date()).alias("Date"))
-        return df
-    except:
+            schema_overrides=FINRA_SCHEMA,
+            columns=["Symbol", "ShortVolume", "ShortExemptVolume", "TotalVolume"],
+        )
+        if df.is_empty():
+            return None
+        df = df.with_columns(pl.lit(datetime.strptime(date_str, "%Y%m%d").date()).alias("Date"))
+    except Exception:
+        return None
+
+    path = finra_cache_path(date_str)
+    try:
+        write_parquet_atomic(df, path, compression="zstd")
+    except OSError:
+        remember_finra_bytes(date_str, body)  # read-only disk – avoid refetching next run
+        return df.lazy()
+    return pl.scan_parquet(path)
+
+
+def cached_finra_date(date_str: str):
+    # Published days never change, so a parquet copy on disk skips both HTTP and CSV parsing.
+    # Shared by the aiohttp and thread-pool paths so both check the caches the same way.
+    path = finra_cache_path(date_str)
+    if os.path.exists(path):
+        return pl.scan_parquet(path)
+    body = recall_finra_bytes(date_str)
+    return parse_finra_date(body, date_str) if body is not None else None
+
+
+async def download_finra_date(session: "aiohttp.ClientSession", date_str: str):
+    lf = cached_finra_date(date_str)
+    if lf is not None:
+        return lf
+    try:
+        async with session.get(finra_url(date_str)) as resp:
+            if resp.status != 200:
+                return None
+            body = await resp.read()
+    except Exception:
+        return None
+    return parse_finra_date(body, date_str)
+
+
+def download_finra_date_sync(date_str: str):
+    lf = cached_finra_date(date_str)
+    if lf is not None:
+        return lf
+    try:
+        with requests.get(finra_url(date_str), timeout=15, stream=True) as resp:
+            if resp.status_code != 200:
+                return None
+            resp.raw.decode_content = True
+            body = resp.raw.read()
+    except Exception:
         return None
+    return parse_finra_date(body, date_str)
+
+
+async def fetch_all(date_strs):
+    # One session, every day in flight at once – results come back in date_strs order
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(download_finra_date(session, d)) for d in date_strs]
+    return [t.result() for t in tasks]
+
+
+def fetch_all_threaded(date_strs):
+    # Without aiohttp: requests releases the GIL while waiting, so threads overlap the I/O.
+    # pool.map keeps date_strs order, same as fetch_all.
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return list(pool.map(download_finra_date_sync, date_strs))
+
+
+def nyse_holidays(year: int):
+    # Full-day NYSE closures for one year, moved to the weekday they are observed on
+    def observed(d):
+        if d.weekday() == 5:
+            return d - timedelta(days=1)
+        if d.weekday() == 6:
+            return d + timedelta(days=1)
+        return d
+
+    def nth_weekday(month, weekday, n):
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    def last_weekday(month, weekday):
+        last = date(year, month + 1, 1) - timedelta(days=1)
+        return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+    # Easter Sunday (anonymous Gregorian algorithm) – Good Friday is two days before
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    easter = date(year, month, day + 1)
+
+    holidays = [
+        nth_weekday(1, 0, 3),               # Martin Luther King Jr. Day
+        nth_weekday(2, 0, 3),               # Presidents' Day
+        easter - timedelta(days=2),         # Good Friday
+        last_weekday(5, 0),                 # Memorial Day
+        observed(date(year, 7, 4)),         # Independence Day
+        nth_weekday(9, 0, 1),               # Labor Day
+        nth_weekday(11, 3, 4),              # Thanksgiving
+        observed(date(year, 12, 25)),       # Christmas
+    ]
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:             # a Saturday New Year's is not observed on Dec 31
+        holidays.append(observed(new_year))
+    if year >= 2022:
+        holidays.append(observed(date(year, 6, 19)))  # Juneteenth
+    return holidays
+
+
+def recent_trading_days(today: date, count: int):
+    # Newest first, as YYYYMMDD – weekends and NYSE holidays never reach the network
+    holidays = np.array(nyse_holidays(today.year - 1) + nyse_holidays(today.year), dtype="datetime64[D]")
+    days = np.busday_offset(np.datetime64(today, "D"), -np.arange(count), roll="backward", holidays=holidays)
+    return [d.replace("-", "") for d in np.datetime_as_string(days)]
 
 
 # =============================================
 # 2. Load data – smart lookback
 # =============================================
+PROCESSED_MAX_AGE = 3600  # seconds, same as the st.cache_data ttl below
+
+
+def save_processed(df: pl.DataFrame, path: str):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Expired results are never read again – clear them so ticker combos don't pile up
+        # (another worker may have removed the same file already)
+        for old_path in glob.glob(os.path.join(CACHE_DIR, "processed_*.parquet")):
+            with contextlib.suppress(FileNotFoundError):
+                if time.time() - os.path.getmtime(old_path) >= PROCESSED_MAX_AGE:
+                    os.remove(old_path)
+        write_parquet_atomic(df, path, compression="zstd", statistics=True)
+    except OSError:
+        pass
+
+
 @st.cache_data(ttl=3600, show_spinner="Loading latest FINRA data...")
-def load_data(lookback_days: int = 1):
-    dfs = []
-    today = datetime.now().date()
-    days_found = 0
-    max_check = 60
-
-    for i in range(max_check):
-        dt = today - timedelta(days=i)
-        if dt.weekday() >= 5:  # skip weekends
-            continue
-        date_str = dt.strftime("%Y%m%d")
-        df = download_finra_date(date_str)
-        if df is not None and not df.is_empty():
-            dfs.append(df)
-            days_found += 1
-            if days_found >= lookback_days:
-                break
+def load_data(lookback_days: int = 1, specific_tickers: list[str] | None = None, compute_rolling: bool = True):
+    # Two spare days cover today's file not being published yet and unscheduled closures
+    date_strs = recent_trading_days(datetime.now().date(), lookback_days + 2)
+
+    if aiohttp is not None:
+        results = asyncio.run(fetch_all(date_strs))
+    else:
+        results = fetch_all_threaded(date_strs)
+    found = [(d, lf) for d, lf in zip(date_strs, results) if lf is not None][:lookback_days]
+    dfs = [lf for _, lf in found]
 
     if not dfs:
         return pl.DataFrame(), None
+    # Newest day actually published – independent of which rows survive the filters below
+    latest_date = datetime.strptime(found[0][0], "%Y%m%d").date()
+
+    # Finished result keyed by the exact days + options – shared by every session/worker
+    key = "|".join([
+        ",".join(d for d, _ in found),
+        str(lookback_days),
+        ",".join(sorted(specific_tickers or [])),
+        str(compute_rolling),
+    ])
+    signature = hashlib.sha1(key.encode()).hexdigest()[:8]
+    processed_path = os.path.join(CACHE_DIR, f"processed_{signature}.parquet")
+    try:
+        if time.time() - os.path.getmtime(processed_path) < PROCESSED_MAX_AGE:
+            return pl.read_parquet(processed_path), latest_date
+    except Exception:
+        pass  # missing, pruned mid-read or unreadable – recompute below
 
-    df_all = pl.concat(dfs)
+    # Shared sub-expressions – Polars' CSE evaluates each once inside a with_columns
+    buy = (pl.col("ShortVolume") + pl.col("ShortExemptVolume")).cast(pl.Int64)
+    dp = buy / pl.col("TotalVolume")
+    noise_filter = (pl.col("TotalVolume") >= 200_000) | (pl.col("BuyVolume") >= 100_000)
 
-    # === Core calculations – IMPORTANT: BuyVolume must be created FIRST ===
+    # One lazy plan, collected once – lets Polars fuse the projections below
+    # Concatenate oldest → newest: every symbol's rows are then already in date order,
+    # so the rolling window below needs no global sort. rechunk=False keeps each day as
+    # its own chunk instead of copying everything into one buffer up front.
+    df_all = pl.concat(dfs[::-1], how="vertical_relaxed", rechunk=False).with_columns(pl.col("Date").set_sorted())
+    if specific_tickers:
+        df_all = df_all.filter(pl.col("Symbol").is_in(specific_tickers))
+    # === Core calculations ===
     df_all = df_all.with_columns([
-        (pl.col("ShortVolume") + pl.col("ShortExemptVolume")).cast(pl.Int64).alias("BuyVolume"),
-        (pl.col("TotalVolume") - (pl.col("ShortVolume") + pl.col("ShortExemptVolume"))).cast(pl.Int64).alias("SellVolume"),
-    ]).with_columns([
+        buy.alias("BuyVolume"),
         pl.when(pl.col("ShortVolume") > 0)
-          .then((pl.col("BuyVolume") / pl.col("ShortVolume")).round(3))
+          .then((buy / pl.col("ShortVolume")).round(3))
           .otherwise(None)
           .alias("BS_Ratio"),
-        (pl.col("BuyVolume") / pl.col("TotalVolume")).round(4).alias("DP_Ratio"),
-        ((pl.col("BuyVolume") / pl.col("TotalVolume")) * 100).round(1).alias("DP_Index_%"),
+        dp.round(4).alias("DP_Ratio"),
+        (dp * 100).round(1).alias("DP_Index_%"),
     ])
 
-    # Relative volume (10-day avg)
-    df_all = df_all.sort(["Symbol", "Date"])
-    df_all = df_all.with_columns(
-        pl.col("TotalVolume")
-        .Rolling_mean(window_size=10, min_periods=1)
-        .over("Symbol")
-        .alias("Avg10d_Volume")
-    ).with_columns(
-        (pl.col("TotalVolume") / pl.col("Avg10d_Volume")).round(2).alias("Relative_Volume")
-    )
+    if compute_rolling:
+        avg10d = pl.col("TotalVolume").rolling_mean(window_size=10, min_samples=1).over("Symbol")
+        df_all = (
+            df_all
+            # Drop symbols that never clear the noise filter before the rolling.
+            # Whole symbols only – dropping single rows here would skew their 10-day average.
+            .filter(noise_filter.any().over("Symbol"))
+            # Relative volume (10-day avg)
+            .with_columns([
+                avg10d.alias("Avg10d_Volume"),
+                (pl.col("TotalVolume") / avg10d).round(2).alias("Relative_Volume"),
+            ])
+        )
+    else:
+        # Single-day view – a 1-day average is the volume itself, so skip the window
+        df_all = df_all.with_columns(pl.lit(1.0).alias("Relative_Volume"))
 
-    # Remove garbage low-volume rows
-    df_all = df_all.filter(
-        (pl.col("TotalVolume") >= 200_000) | (pl.col("BuyVolume") >= 100_000)
-    )
+    # Remove garbage low-volume rows.
+    # Long lookbacks run on the streaming engine so peak memory stays bounded.
+    engine = "streaming" if lookback_days > 10 else "auto"
+    df_all = df_all.filter(noise_filter).collect(engine=engine)
 
-    latest_date = df_all["Date"].max()
+    save_processed(df_all, processed_path)
     return df_all, latest_date
 
 
 # =============================================
 # 3. Market cap (optional)
 # =============================================
-@st.cache_data(ttl=86400)
-def get_market_caps(symbols):
+def yahoo_session():
+    # The quote endpoint wants a cookie + crumb pair, same handshake yfinance does
+    session = requests.Session()
+    session.headers["User-Agent"] = "Mozilla/5.0"
+    try:
+        session.get("https://fc.yahoo.com", timeout=10)
+    except requests.RequestException:
+        pass  # fc.yahoo.com 404s by design – only the cookie matters
+    crumb = session.get("https://query1.finance.yahoo.com/v1/test/getcrumb", timeout=10).text
+    return session, crumb
+
+
+def fetch_market_caps(symbols):
+    # Only symbols whose quote request succeeded come back – failures are retried next time
     caps = {}
-    for sym in symbols[:70]:
+    try:
+        session, crumb = yahoo_session()
+    except Exception:
+        return caps
+
+    def fetch_chunk(chunk):
         try:
-            info = yf.Ticker(sym).fast_info
-            cap = info.get("marketCap")
-            caps[sym] = round(cap / 1e9, 2) if cap else 0
-        except:
-            caps[sym] = 0
+            resp = session.get(
+                "https://query1.finance.yahoo.com/v7/finance/quote",
+                params={"symbols": ",".join(chunk), "crumb": crumb},
+                timeout=10,
+            )
+            result = resp.json()["quoteResponse"]["result"]
+        except Exception:
+            return {}
+        chunk_caps = {sym: 0.0 for sym in chunk}  # answered but unknown to Yahoo
+        for item in result:
+            cap = item.get("marketCap")
+            chunk_caps[item["symbol"]] = round(cap / 1e9, 2) if cap else 0.0
+        return chunk_caps
+
+    # One quote request per 20 symbols instead of one per symbol, chunks fetched in parallel
+    chunks = [symbols[i:i + 20] for i in range(0, len(symbols), 20)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for chunk_caps in pool.map(fetch_chunk, chunks):
+            caps.update(chunk_caps)
     return caps
 
 
+MARKET_CAPS_PATH = os.path.join(CACHE_DIR, "marketcaps.parquet")
+MARKET_CAPS_MAX_AGE = 86400  # seconds
+
+
+def load_market_cap_store():
+    # {symbol: (market_cap_b, fetched_at)} – survives restarts, unlike st.cache_data
+    if not os.path.exists(MARKET_CAPS_PATH):
+        return {}
+    try:
+        store = pl.read_parquet(MARKET_CAPS_PATH)
+    except Exception:
+        return {}
+    return {sym: (cap, fetched_at) for sym, cap, fetched_at in store.iter_rows()}
+
+
+def save_market_cap_store(store):
+    df = pl.DataFrame(
+        {
+            "Symbol": list(store.keys()),
+            "MarketCap_B": [cap for cap, _ in store.values()],
+            "FetchedAt": [fetched_at for _, fetched_at in store.values()],
+        },
+        schema={"Symbol": pl.Utf8, "MarketCap_B": pl.Float64, "FetchedAt": pl.Float64},
+    )
+    try:
+        write_parquet_atomic(df, MARKET_CAPS_PATH)
+    except OSError:
+        pass
+
+
+def get_market_caps(symbols):
+    # No st.cache_data here – it would pin a failed chunk's zeros for a day. The store's
+    # staleness check already keeps Yahoo traffic down and retries failures next call.
+    symbols = symbols[:70]
+    store = load_market_cap_store()
+    now = time.time()
+
+    stale = [sym for sym in symbols if sym not in store or now - store[sym][1] >= MARKET_CAPS_MAX_AGE]
+    if stale:
+        fetched = fetch_market_caps(stale)
+        if fetched:
+            store.update({sym: (cap, now) for sym, cap in fetched.items()})
+            save_market_cap_store(store)
+
+    return {sym: store[sym][0] if sym in store else 0 for sym in symbols}
+
+
 # =============================================
 # 4. MAIN APP
 # =============================================
@@ -120,7 +425,10 @@ df = pl.DataFrame()
 latest_date = None
 
 if mode == "Latest Day (All Stocks)":
-    df, latest_date = load_data(lookback_days=1)
+    df, latest_date = load_data(lookback_days=1, compute_rolling=False)
+    if latest_date is None:
+        st.error("Could not load any FINRA data – try again later.")
+        st.stop()
     st.success(f"Showing **all significant dark pool activity** – {latest_date.strftime('%A, %B %d, %Y')}")
 
     # Filters for latest day
@@ -142,8 +450,11 @@ else:  # Specific tickers + history
         st.warning("Please enter at least one ticker.")
         st.stop()
 
-    df, latest_date = load_data(lookback_days=days_back)
-    filtered = df.filter(pl.col("Symbol").is_in(tickers))
+    df, latest_date = load_data(lookback_days=days_back, specific_tickers=tickers, compute_rolling=True)
+    if latest_date is None:
+        st.error("Could not load any FINRA data – try again later.")
+        st.stop()
+    filtered = df
 
     st.success(f"Showing **{len(tickers)} tickers** – last **{days_back} trading days** up to **{latest_date.strftime('%B %d, %Y')}**")
 
@@ -154,7 +465,7 @@ if use_cap and not filtered.is_empty():
     syms = filtered["Symbol"].unique().to_list()
     caps = get_market_caps(syms)
     filtered = filtered.with_columns(
-        pl.col("Symbol").map_elements(lambda x: caps.get(x, 0), return_dtype=pl.Float64).alias("MarketCap_B")
+        pl.col("Symbol").replace_strict(caps, default=0.0, return_dtype=pl.Float64).alias("MarketCap_B")
     ).filter(pl.col("MarketCap_B") >= min_cap_b)
 else:
     filtered = filtered.with_columns(pl.lit(None).alias("MarketCap_B"))
@@ -170,10 +481,14 @@ cols = ["Date", "Symbol", "BuyVolume", "TotalVolume", "DP_Ratio", "DP_Index_%",
 if use_cap:
     cols.append("MarketCap_B")
 
+# Fixed 3-decimal DP_Ratio string, built from integer thousandths so it stays in Polars
+dp_milli = (pl.col("DP_Ratio") * 1000).round(0).cast(pl.Int64)
 display_df = (
     filtered.select(cols)
     .sort(["Date", "DP_Ratio"], descending=[True, True])
-    .with_columns(pl.col("DP_Ratio").map_elements(lambda x: f"{x:.3f}", return_dtype=pl.Utf8))
+    .with_columns(
+        pl.format("{}.{}", dp_milli // 1000, (dp_milli % 1000).cast(pl.Utf8).str.zfill(3)).alias("DP_Ratio")
+    )
 )
 
 st.write(f"**{len(display_df):,} dark pool prints found**")
@@ -182,10 +497,16 @@ st.dataframe(display_df, use_container_width=True, hide_index=True)
 # Chart
 if len(display_df) > 1:
     st.subheader("Dark Pool Ratio Trend")
-    chart_df = display_df.pivot(
-        values="DP_Ratio",
-        index="Date",
-        columns="Symbol",
-        aggregate_function="mean"
-    ).sort("Date").fill_null(0)
-    st.line_chart(chart_df.set_index("Date"), height=450)
+    # Long-form data straight into the chart – no dense Date × Symbol matrix.
+    # Keep the legend readable by charting only the highest average DP ratios.
+    top_syms = (
+        filtered.group_by("Symbol")
+        .agg(pl.col("DP_Ratio").mean())
+        .top_k(20, by="DP_Ratio")["Symbol"]
+    )
+    chart_df = (
+        filtered.filter(pl.col("Symbol").is_in(top_syms.to_list()))
+        .select(["Date", "Symbol", "DP_Ratio"])
+        .sort("Date")
+    )
+    st.line_chart(chart_df.to_pandas(), x="Date", y="DP_Ratio", color="Symbol", height=450)
@@ -1,22 +1,34 @@
 import requests
 import polars as pl
 from datetime import datetime
-import io
 
-@st.cache_data(ttl="24h", show_spinner="Updating daily FINRA data...")
-def load_data(lookback_days: int = 1):
-    
+FINRA_SCHEMA = {
+    "Date": pl.Utf8,
+    "Symbol": pl.Utf8,
+    "ShortVolume": pl.Float64,
+    "ShortExemptVolume": pl.Float64,
+    "TotalVolume": pl.Float64,
+    "Market": pl.Utf8,
+}
+
 def download_today():
     date_str = datetime.now().strftime("%Y%m%d")
     url = f"https://cdn.finra.org/equity/regsho/daily/CNMSshvol{date_str}.txt"
-    resp = requests.get(url)
-    if resp.status_code == 200:
-        df = pl.read_csv(io.BytesIO(resp.content), separator="|", has_header=True)
-        print(f"Downloaded {len(df)} rows for {date_str}")
-        return df
-    else:
-        print(f"No data for {date_str}")
-        return None
+    with requests.get(url, timeout=10, stream=True) as resp:
+        if resp.status_code != 200:
+            print(f"No data for {date_str}")
+            return None
+        # Read the raw body in one go instead of requests' 8 KiB iter_content chunks
+        resp.raw.decode_content = True
+        buf = resp.raw.read()
+    df = pl.read_csv(
+        buf,
+        separator="|",
+        has_header=True,
+        schema_overrides=FINRA_SCHEMA,
+    )
+    print(f"Downloaded {len(df)} rows for {date_str}")
+    return df
 
 if __name__ == "__main__":
     download_today()